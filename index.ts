@@ -205,7 +205,7 @@ function probabilityWithinExponential(meanInterval: number, wait: number): numbe
   if (meanInterval <= 0) {
     return 1;
   }
-  return 1 - Math.exp(-wait / meanInterval);
+  return -Math.expm1(-wait / meanInterval);
 }
 
 function withEconomics(
@@ -403,7 +403,7 @@ function runWinnerTimestampsMode(inputs: Inputs): Output {
     };
   }
 
-  const randomWaitForTarget = -intervalMean * Math.log(1 - probabilityTarget);
+  const randomWaitForTarget = -intervalMean * Math.log1p(-probabilityTarget);
   const mixedWaitForTarget = (regularRemaining + randomWaitForTarget) / 2;
 
   let optimalWait = regularRemaining;
@@ -3,20 +3,47 @@
 
 from __future__ import annotations
 
-import argparse
-import json
 import math
-import re
+import sys
 from datetime import datetime
-from statistics import mean, stdev
-from typing import Any
+from functools import lru_cache
+from itertools import islice
+from operator import sub
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    import argparse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-HMS_RE = re.compile(r"^(\d{1,2}):(\d{2})(?::(\d{2}))?$")
 EPSILON = 1e-9
+SECONDS_PER_DAY = 24 * 3600
+K_WEEKEND, K_WEEKDAY = 50, 25
+PWIN_WEEKEND, PWIN_WEEKDAY = round(1.0 / K_WEEKEND, 4), round(1.0 / K_WEEKDAY, 4)
+CV_REGULAR = 0.4
+CV_RANDOM = 0.7
+NEG_LOG_1M_P50 = -math.log(1.0 - 0.5)
+NEG_LOG_1M_P75 = -math.log(1.0 - 0.75)
+NEG_LOG_1M_P90 = -math.log(1.0 - 0.9)
+PURCHASE_RATE_REQUIRED = (
+    "is_weekend_or_holiday",
+    "model",
+    "observed_purchases",
+    "observed_minutes",
+    "observed_lanes",
+)
+PURCHASE_RATE_REQUIRED_SET = frozenset(PURCHASE_RATE_REQUIRED)
+ASCII_ZERO = 48  # ord("0")
+ASCII_COLON = 58  # ord(":")
 
 
 def clamp(value: float, low: float, high: float) -> float:
-    return max(low, min(high, value))
+    if not value < high:
+        value = high
+    return value if value > low else low
 
 
 def round2(value: float) -> float:
@@ -24,53 +51,115 @@ def round2(value: float) -> float:
 
 
 def parse_hms_to_seconds(value: str) -> int | None:
-    match = HMS_RE.match(value)
-    if not match:
+    if not value.isascii():
+        # The previous regex's \d matched any Unicode decimal digit; map those to ASCII first.
+        value = "".join(str(int(char)) if char.isdecimal() else char for char in value)
+        if not value.isascii():
+            return None
+    raw = value.encode("ascii")
+    if raw.endswith(b"\n"):
+        # The previous `$`-anchored regex also accepted a single trailing newline.
+        raw = raw[:-1]
+    size = len(raw)
+    if size == 4 or size == 7:
+        hour_width = 1
+    elif size == 5 or size == 8:
+        hour_width = 2
+    else:
         return None
-    hour = int(match.group(1))
-    minute = int(match.group(2))
-    second = int(match.group(3) or "0")
-    if not (0 <= hour <= 23 and 0 <= minute <= 59 and 0 <= second <= 59):
+    has_seconds = size > hour_width + 3
+    if raw[hour_width] != ASCII_COLON or (has_seconds and raw[hour_width + 3] != ASCII_COLON):
+        return None
+    digits = raw.translate(None, b":")
+    if len(digits) != size - 1 - has_seconds or not digits.isdigit():
+        return None
+
+    if hour_width == 1:
+        hour = digits[0] - ASCII_ZERO
+    else:
+        hour = (digits[0] - ASCII_ZERO) * 10 + digits[1] - ASCII_ZERO
+    minute = (digits[hour_width] - ASCII_ZERO) * 10 + digits[hour_width + 1] - ASCII_ZERO
+    second = 0
+    if has_seconds:
+        second = (digits[hour_width + 2] - ASCII_ZERO) * 10 + digits[hour_width + 3] - ASCII_ZERO
+    if hour > 23 or minute > 59 or second > 59:
         return None
     return hour * 3600 + minute * 60 + second
 
 
-def parse_iso_to_minutes(value: str) -> float:
-    fixed = value.replace("Z", "+00:00")
-    parsed = datetime.fromisoformat(fixed)
-    return parsed.timestamp() / 60.0
+if sys.version_info >= (3, 11):
+    # fromisoformat accepts a trailing "Z" from Python 3.11 on.
+
+    def parse_iso_to_minutes(value: str) -> float:
+        return datetime.fromisoformat(value).timestamp() / 60.0
+
+else:
+
+    def parse_iso_to_minutes(value: str) -> float:
+        fixed = value.replace("Z", "+00:00")
+        parsed = datetime.fromisoformat(fixed)
+        return parsed.timestamp() / 60.0
+
+
+parse_iso_to_minutes_cached = lru_cache(maxsize=4096)(parse_iso_to_minutes)
+
+
+def parse_hms_values(timestamps: list[str]) -> list[int] | None:
+    hms_values: list[int] = []
+    for item in timestamps:
+        seconds = parse_hms_to_seconds(item)
+        if seconds is None:
+            return None
+        hms_values.append(seconds)
+    return hms_values
+
+
+def intervals_from_timeline_minutes(timeline: list[float]) -> list[float]:
+    return list(map(sub, islice(timeline, 1, None), timeline))
+
+
+def intervals_from_hms_values(hms_values: list[int]) -> list[float]:
+    # Times not after the previous one are on the next day. Intervals are differences of the unrolled
+    # minute values, so they round exactly as a minutes timeline would.
+    intervals: list[float] = []
+    elapsed = hms_values[0]
+    previous_minutes = elapsed / 60.0
+    for previous, candidate in zip(hms_values, islice(hms_values, 1, None)):
+        elapsed += (candidate - previous - 1) % SECONDS_PER_DAY + 1
+        minutes = elapsed / 60.0
+        intervals.append(minutes - previous_minutes)
+        previous_minutes = minutes
+    return intervals
 
 
-def parse_timestamps_to_minutes(timestamps: list[str]) -> list[float]:
+def intervals_from_timestamps(timestamps: list[str]) -> list[float]:
     if len(timestamps) < 2:
         raise ValueError("winner_timestamps necesita minimo 2 timestamps.")
 
-    hms_values = [parse_hms_to_seconds(item) for item in timestamps]
-    if all(item is not None for item in hms_values):
-        timeline_seconds: list[int] = []
-        current = hms_values[0] or 0
-        timeline_seconds.append(current)
-        for item in hms_values[1:]:
-            candidate = item or 0
-            while candidate <= current:
-                candidate += 24 * 3600
-            timeline_seconds.append(candidate)
-            current = candidate
-        return [sec / 60.0 for sec in timeline_seconds]
-
-    timeline = [parse_iso_to_minutes(item) for item in timestamps]
-    for idx in range(1, len(timeline)):
-        if timeline[idx] <= timeline[idx - 1]:
-            raise ValueError("timestamps ISO deben estar ordenados ascendentemente.")
-    return timeline
+    hms_values = parse_hms_values(timestamps)
+    if hms_values is not None:
+        return intervals_from_hms_values(hms_values)
 
+    intervals = intervals_from_timeline_minutes([parse_iso_to_minutes_cached(item) for item in timestamps])
+    if min(intervals) <= 0:
+        raise ValueError("timestamps ISO deben estar ordenados ascendentemente.")
+    return intervals
 
-def intervals_from_timeline_minutes(timeline: list[float]) -> list[float]:
-    return [timeline[idx] - timeline[idx - 1] for idx in range(1, len(timeline))]
+
+def mean_and_stdev(values: list[float]) -> tuple[float, float]:
+    count = len(values)
+    if count == 0:
+        raise ValueError("mean_and_stdev necesita minimo 1 valor.")
+    mu = math.fsum(values) / count
+    # fsum / n rounds twice; one exact-residual step makes the mean correctly rounded, like statistics.mean.
+    mu += math.fsum([*values, *([-mu] * count)]) / count
+    if count == 1:
+        return mu, 0.0
+    return mu, math.sqrt(math.fsum((value - mu) ** 2 for value in values) / (count - 1))
 
 
 def threshold_from_day(is_weekend_or_holiday: bool) -> int:
-    return 50 if is_weekend_or_holiday else 25
+    return K_WEEKEND if is_weekend_or_holiday else K_WEEKDAY
 
 
 def probability_uniform(interval_minutes: float, wait_minutes: float) -> float:
@@ -82,18 +171,17 @@ def probability_uniform(interval_minutes: float, wait_minutes: float) -> float:
 def probability_exponential(mean_interval: float, wait_minutes: float) -> float:
     if mean_interval <= 0:
         return 1.0
-    return 1.0 - math.exp(-wait_minutes / mean_interval)
+    return -math.expm1(-wait_minutes / mean_interval)
 
 
 def maybe_economics(
-    payload: dict[str, Any],
+    expected_bonus: Any,
+    value_per_min: Any,
     probability_within_wait: float,
     mean_interval: float,
     max_wait: float,
     optimal_wait: float,
 ) -> dict[str, Any] | None:
-    expected_bonus = payload.get("expected_bonus_value")
-    value_per_min = payload.get("time_value_per_minute")
     if not isinstance(expected_bonus, (int, float)):
         return None
     if not isinstance(value_per_min, (int, float)):
@@ -117,16 +205,11 @@ def maybe_economics(
 
 
 def run_purchase_rate(payload: dict[str, Any]) -> dict[str, Any]:
-    required = [
-        "is_weekend_or_holiday",
-        "model",
-        "observed_purchases",
-        "observed_minutes",
-        "observed_lanes",
-    ]
-    for key in required:
-        if key not in payload:
-            raise ValueError(f"Falta campo requerido: {key}")
+    missing = PURCHASE_RATE_REQUIRED_SET - payload.keys()
+    if missing:
+        # Report the first missing key in declaration order, as the per-key loop did.
+        key = next(name for name in PURCHASE_RATE_REQUIRED if name in missing)
+        raise ValueError(f"Falta campo requerido: {key}")
 
     is_weekend = bool(payload["is_weekend_or_holiday"])
     model = payload["model"]
@@ -137,6 +220,8 @@ def run_purchase_rate(payload: dict[str, Any]) -> dict[str, Any]:
     max_wait = max(float(payload.get("max_wait_minutes", 30.0)), 1.0)
     confidence_buffer = clamp(float(payload.get("confidence_buffer", 0.2)), 0.0, 0.9)
     target_probability = clamp(float(payload.get("target_hit_probability", 0.75)), 0.5, 0.99)
+    expected_bonus = payload.get("expected_bonus_value")
+    value_per_min = payload.get("time_value_per_minute")
 
     if observed_purchases <= 0 or observed_minutes <= 0 or observed_lanes <= 0:
         raise ValueError("observed_purchases/observed_minutes/observed_lanes deben ser > 0.")
@@ -159,7 +244,7 @@ def run_purchase_rate(payload: dict[str, Any]) -> dict[str, Any]:
     result = {
         "mode": "purchase_rate",
         "k_threshold_clients": k,
-        "probability_win_per_attempt": round(1.0 / k, 4),
+        "probability_win_per_attempt": PWIN_WEEKEND if is_weekend else PWIN_WEEKDAY,
         "rates": {
             "purchases_per_minute_observed": round2(lambda_obs),
             "purchases_per_minute_estimated": round2(lambda_est),
@@ -180,7 +265,9 @@ def run_purchase_rate(payload: dict[str, Any]) -> dict[str, Any]:
         },
     }
 
-    economics = maybe_economics(payload, probability_within, interval, max_wait, optimal_wait)
+    economics = maybe_economics(
+        expected_bonus, value_per_min, probability_within, interval, max_wait, optimal_wait
+    )
     if economics is not None:
         result["economics"] = economics
 
@@ -197,30 +284,33 @@ def run_winner_timestamps(payload: dict[str, Any]) -> dict[str, Any]:
     max_wait = max(float(payload.get("max_wait_minutes", 30.0)), 1.0)
     target_probability = clamp(float(payload.get("target_hit_probability", 0.75)), 0.5, 0.99)
     elapsed = max(float(payload.get("elapsed_since_last_winner_minutes", 0.0)), 0.0)
+    expected_bonus = payload.get("expected_bonus_value")
+    value_per_min = payload.get("time_value_per_minute")
 
-    timeline = parse_timestamps_to_minutes(timestamps)
-    intervals = intervals_from_timeline_minutes(timeline)
-    mu = mean(intervals)
-    sigma = stdev(intervals) if len(intervals) > 1 else 0.0
+    intervals = intervals_from_timestamps(timestamps)
+    mu, sigma = mean_and_stdev(intervals)
     cv = sigma / max(mu, EPSILON)
 
-    if cv < 0.4:
+    if cv < CV_REGULAR:
         cadence_model = "regular"
-    elif cv > 0.7:
+    elif cv > CV_RANDOM:
         cadence_model = "random"
     else:
         cadence_model = "mixed"
 
     regular_remaining = max(mu - elapsed, 0.0)
-    random_wait_target = -mu * math.log(1.0 - target_probability)
+    random_wait_target = -mu * math.log1p(-target_probability)
 
     if cadence_model == "regular":
         optimal_wait = regular_remaining
     elif cadence_model == "random":
         optimal_wait = random_wait_target
     else:
-        optimal_wait = (regular_remaining + random_wait_target) / 2.0
-    optimal_wait = clamp(optimal_wait, 0.0, max_wait)
+        optimal_wait = 0.5 * (regular_remaining + random_wait_target)
+    if not optimal_wait < max_wait:
+        optimal_wait = max_wait
+    if not optimal_wait > 0.0:
+        optimal_wait = 0.0
 
     regular_prob = 1.0 if regular_remaining <= EPSILON else clamp(optimal_wait / regular_remaining, 0.0, 1.0)
     random_prob = probability_exponential(mu, optimal_wait)
@@ -229,7 +319,7 @@ def run_winner_timestamps(payload: dict[str, Any]) -> dict[str, Any]:
     elif cadence_model == "random":
         probability_within = random_prob
     else:
-        probability_within = (regular_prob + random_prob) / 2.0
+        probability_within = 0.5 * (regular_prob + random_prob)
 
     if cadence_model == "regular":
         wait_estimates = {
@@ -243,23 +333,23 @@ def run_winner_timestamps(payload: dict[str, Any]) -> dict[str, Any]:
         wait_estimates = {
             "mean_interval_between_winners": round2(mu),
             "expected_wait_to_next_winner": round2(mu),
-            "p50_wait_to_next_winner": round2(-mu * math.log(1.0 - 0.5)),
-            "p75_wait_to_next_winner": round2(-mu * math.log(1.0 - 0.75)),
-            "p90_wait_to_next_winner": round2(-mu * math.log(1.0 - 0.9)),
+            "p50_wait_to_next_winner": round2(mu * NEG_LOG_1M_P50),
+            "p75_wait_to_next_winner": round2(mu * NEG_LOG_1M_P75),
+            "p90_wait_to_next_winner": round2(mu * NEG_LOG_1M_P90),
         }
     else:
         wait_estimates = {
             "mean_interval_between_winners": round2(mu),
-            "expected_wait_to_next_winner": round2((regular_remaining + mu) / 2.0),
-            "p50_wait_to_next_winner": round2((regular_remaining + (-mu * math.log(1.0 - 0.5))) / 2.0),
-            "p75_wait_to_next_winner": round2((regular_remaining + (-mu * math.log(1.0 - 0.75))) / 2.0),
-            "p90_wait_to_next_winner": round2((regular_remaining + (-mu * math.log(1.0 - 0.9))) / 2.0),
+            "expected_wait_to_next_winner": round2(0.5 * (regular_remaining + mu)),
+            "p50_wait_to_next_winner": round2(0.5 * (regular_remaining + mu * NEG_LOG_1M_P50)),
+            "p75_wait_to_next_winner": round2(0.5 * (regular_remaining + mu * NEG_LOG_1M_P75)),
+            "p90_wait_to_next_winner": round2(0.5 * (regular_remaining + mu * NEG_LOG_1M_P90)),
         }
 
     result: dict[str, Any] = {
         "mode": "winner_timestamps",
         "cadence_analysis": {
-            "intervals_minutes": [round2(interval) for interval in intervals],
+            "intervals_minutes": list(map(round2, intervals)),
             "interval_mean_minutes": round2(mu),
             "interval_std_minutes": round2(sigma),
             "interval_cv": round2(cv),
@@ -274,11 +364,11 @@ def run_winner_timestamps(payload: dict[str, Any]) -> dict[str, Any]:
     }
 
     if "is_weekend_or_holiday" in payload:
-        k = threshold_from_day(bool(payload["is_weekend_or_holiday"]))
-        result["k_threshold_clients"] = k
-        result["probability_win_per_attempt"] = round(1.0 / k, 4)
+        is_weekend = bool(payload["is_weekend_or_holiday"])
+        result["k_threshold_clients"] = threshold_from_day(is_weekend)
+        result["probability_win_per_attempt"] = PWIN_WEEKEND if is_weekend else PWIN_WEEKDAY
 
-    economics = maybe_economics(payload, probability_within, mu, max_wait, optimal_wait)
+    economics = maybe_economics(expected_bonus, value_per_min, probability_within, mu, max_wait, optimal_wait)
     if economics is not None:
         result["economics"] = economics
 
@@ -295,20 +385,68 @@ def run(payload: dict[str, Any]) -> dict[str, Any]:
 
 
 def parse_args() -> argparse.Namespace:
+    import argparse
+
     parser = argparse.ArgumentParser(description="Calculate Alkosto waiting-time estimates.")
-    parser.add_argument("--input-json", required=True, help="JSON string with mode and inputs.")
-    parser.add_argument("--pretty", action="store_true", help="Pretty-print JSON output.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input-json", help="JSON string with mode and inputs.")
+    source.add_argument(
+        "--batch-jsonl",
+        action="store_true",
+        help="Read one JSON payload per stdin line and write one JSON result per stdout line.",
+    )
+    parser.add_argument(
+        "--pretty", action="store_true", help="Pretty-print JSON output (ignored with --batch-jsonl)."
+    )
     return parser.parse_args()
 
 
+def finite_or_none(value: Any) -> Any:
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: finite_or_none(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [finite_or_none(item) for item in value]
+    return value
+
+
+def dumps_json(value: Any, pretty: bool) -> str:
+    # Non-finite floats are written as null, which is what orjson emits; json.dumps would write Infinity/NaN.
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_INDENT_2 if pretty else 0).decode("utf-8")
+    import json
+
+    indent = 2 if pretty else None
+    try:
+        return json.dumps(value, ensure_ascii=False, indent=indent, allow_nan=False)
+    except ValueError:
+        return json.dumps(finite_or_none(value), ensure_ascii=False, indent=indent)
+
+
 def main() -> int:
+    import json
+
     args = parse_args()
+    if args.batch_jsonl:
+        failed = False
+        for line_number, line in enumerate(sys.stdin, 1):
+            if not line.strip():
+                continue
+            try:
+                payload = json.loads(line)
+                if not isinstance(payload, dict):
+                    raise ValueError("cada linea debe ser un objeto JSON.")
+                result = run(payload)
+            except (TypeError, ValueError) as exc:
+                failed = True
+                result = {"line": line_number, "error": str(exc)}
+            sys.stdout.write(dumps_json(result, False) + "\n")
+        return 1 if failed else 0
+
     payload = json.loads(args.input_json)
     result = run(payload)
-    if args.pretty:
-        print(json.dumps(result, ensure_ascii=False, indent=2))
-    else:
-        print(json.dumps(result, ensure_ascii=False))
+    print(dumps_json(result, args.pretty))
     return 0
 
 